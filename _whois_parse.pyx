@@ -0,0 +1,79 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+#
+# C version of create_tsv.split_blocks, build it in place with
+#
+#   cythonize -i -3 _whois_parse.pyx
+#
+# create_tsv.py falls back to the pure Python tokenizer if this module
+# has not been built.
+
+from cpython.bytes cimport PyBytes_AsStringAndSize, PyBytes_FromStringAndSize
+from libc.string cimport memchr, memcmp
+
+
+cdef inline bint starts_with(const char *p, Py_ssize_t n, const char *prefix, Py_ssize_t k):
+    return n >= k and memcmp(p, prefix, k) == 0
+
+
+cdef inline bint is_block_start(const char *p, Py_ssize_t n):
+    # APNIC/LACNIC/RIPE/AFRINIC/IRR are all in RPSL
+    return (starts_with(p, n, b'inetnum:', 8) or
+            starts_with(p, n, b'inet6num:', 9) or
+            starts_with(p, n, b'route:', 6) or
+            starts_with(p, n, b'route6:', 7) or
+            starts_with(p, n, b'route-set:', 10) or
+            # ARIN's WHOIS database is in a custom format
+            starts_with(p, n, b'NetHandle:', 10) or
+            starts_with(p, n, b'V6NetHandle:', 12) or
+            starts_with(p, n, b'OrgID:', 6))
+
+
+cdef inline bint is_blank(const char *p, Py_ssize_t n):
+    cdef Py_ssize_t i
+    for i in range(n):
+        if p[i] not in b' \t\n\r\x0b\x0c':
+            return False
+    return True
+
+
+cpdef list read_blocks_c(bytes data):
+    cdef char *buf
+    cdef Py_ssize_t size
+    PyBytes_AsStringAndSize(data, &buf, &size)
+
+    cdef list blocks = []
+    cdef list parts = []
+    cdef Py_ssize_t pos = 0
+    cdef Py_ssize_t end
+    # start of the lines not yet copied into parts and of the whole block,
+    # -1 while there is none
+    cdef Py_ssize_t segment_start = -1
+    cdef Py_ssize_t block_start = -1
+    cdef const char *newline
+
+    while pos < size:
+        newline = <const char *>memchr(buf + pos, c'\n', size - pos)
+        end = newline - buf + 1 if newline != NULL else size
+
+        # skip comments, lines before them stay part of the block
+        if buf[pos] == c'%' or buf[pos] == c'#':
+            if segment_start != -1:
+                parts.append(PyBytes_FromStringAndSize(buf + segment_start, pos - segment_start))
+                segment_start = -1
+        # block end
+        elif is_blank(buf + pos, end - pos):
+            if segment_start != -1:
+                parts.append(PyBytes_FromStringAndSize(buf + segment_start, pos - segment_start))
+                segment_start = -1
+            if block_start != -1 and is_block_start(buf + block_start, size - block_start):
+                blocks.append(parts[0] if len(parts) == 1 else b''.join(parts))
+            parts = []
+            block_start = -1
+        else:
+            if segment_start == -1:
+                segment_start = pos
+            if block_start == -1:
+                block_start = pos
+        pos = end
+
+    return blocks
@@ -4,15 +4,35 @@
 import re
 import argparse
 import gzip
+import ipaddress
 import time
 import csv
+import functools
 import logging
 import math
+import multiprocessing
 import os
 import os.path
+import queue
+import sys
+import threading
 
-from netaddr import iprange_to_cidrs
-from irrd.rpsl.rpsl_objects import rpsl_object_from_text
+from netaddr import AddrFormatError, iprange_to_cidrs
+
+try:
+    import rapidgzip
+except ImportError:
+    rapidgzip = None
+
+try:
+    from isal import igzip
+except ImportError:
+    igzip = None
+
+try:
+    from _whois_parse import read_blocks_c
+except ImportError:
+    read_blocks_c = None
 
 
 FILELIST = [
@@ -45,12 +65,44 @@ FILELIST = [
 ARIN_ORGS = {}
 LOG_FORMAT = '%(asctime)-15s - %(name)-9s - %(levelname)-8s - %(processName)-11s - %(filename)s - %(message)s'
 CURRENT_FILENAME = "empty"
+# the reader thread logs for its own file without touching CURRENT_FILENAME
+LOG_CONTEXT = threading.local()
 VERSION = '2.0'
+# honour the CPU affinity mask where the platform supports one
+if hasattr(os, 'sched_getaffinity'):
+    NUM_WORKERS = len(os.sched_getaffinity(0))
+else:
+    NUM_WORKERS = os.cpu_count()
+# the parser processes already use every core, leave rapidgzip a share only
+DECODE_THREADS = max(1, NUM_WORKERS // 4)
+READ_SIZE = 1 << 20
+WRITE_BUFFER_SIZE = 1 << 20
+WRITE_BATCH_SIZE = 4096
+TASK_BATCH_SIZE = 256
+TASK_QUEUE_SIZE = 64
+
+# APNIC/LACNIC/RIPE/AFRINIC/IRR are all in RPSL
+_RPSL_PREFIXES = (b'inetnum:', b'inet6num:', b'route:', b'route6:', b'route-set:')
+# ARIN's WHOIS database is in a custom format
+_ARIN_PREFIXES = (b'NetHandle:', b'V6NetHandle:', b'OrgID:')
+
+# Patterns are compiled once here since they run against every single block
+# the value never reaches into the next line, attributes without a value
+# are skipped instead of swallowing the following attribute
+_FIELD_RE = re.compile(rb'^([\w-]+):[ \t]*(\S.*)$', re.MULTILINE)
+_RPSL_FIELD_RE = re.compile(rb'^([\w-]+):(.*(?:\n[ \t+].*)*)', re.MULTILINE)
+_NETRANGE_V4_RE = re.compile(rb'^NetRange:[\s]*((?:\d{1,3}\.){3}\d{1,3})[\s]*-[\s]*((?:\d{1,3}\.){3}\d{1,3})', re.MULTILINE)
+_NETRANGE_V6_RE = re.compile(rb'^NetRange:[\s]*([0-9a-fA-F:\/]{1,43})[\s]*-[\s]*([0-9a-fA-F:\/]{1,43})', re.MULTILINE)
+# whitespace-only lines end a block, comment lines are dropped from it
+_BLANK_LINES_RE = re.compile(rb'^(?:[ \t\r\x0b\x0c]*\n|[ \t\r\x0b\x0c]+\Z)+', re.MULTILINE)
+_COMMENT_RE = re.compile(rb'^[%#].*\n?', re.MULTILINE)
+_LACNIC_CIDR_RE = re.compile(r'^\d{1,3}(?:\.\d{1,3}){0,2}/\d{1,2}$')
+_IP_RANGE_V4_RE = re.compile(r'((?:\d{1,3}\.){3}\d{1,3})[\s]*-[\s]*((?:\d{1,3}\.){3}\d{1,3})')
 
 
 class ContextFilter(logging.Filter):
     def filter(self, record):
-        record.filename = CURRENT_FILENAME
+        record.filename = getattr(LOG_CONTEXT, 'filename', CURRENT_FILENAME)
         return True
 
 
@@ -64,260 +116,421 @@ stream_handler.setFormatter(formatter)
 logger.addHandler(stream_handler)
 
 
-def get_source(filename: str):
+def get_source(filename: str) -> str:
     if filename.startswith('afrinic'):
-        return b'afrinic'
+        return 'afrinic'
     elif filename.startswith('apnic'):
-        return b'apnic'
+        return 'apnic'
     elif filename.startswith('arin'):
-        return b'arin'
+        return 'arin'
     elif filename.startswith('lacnic'):
-        return b'lacnic'
+        return 'lacnic'
     elif filename.startswith('ripe'):
-        return b'ripe'
+        return 'ripe'
     elif filename.startswith('level3'):
-        return b'level3'
+        return 'level3'
     elif filename.startswith('nttcom'):
-        return b'nttcom'
+        return 'nttcom'
     elif filename.startswith('radb'):
-        return b'radb'
+        return 'radb'
     elif filename.startswith('tc'):
-        return b'tc'
+        return 'tc'
     else:
         logger.error(f"Can not determine source for {filename}")
     return None
 
 
-def parse_property(block: str, name: str) -> str:
-    match = re.findall('^%s:\s?(.+)$' % (name), block, re.MULTILINE)
+def parse_fields(block: bytes) -> dict:
+    # scan the block once and collect every "key: value" line, the
+    # individual properties are then looked up from the returned dict
+    fields = {}
+    for m in _FIELD_RE.finditer(block):
+        fields.setdefault(m.group(1), []).append(m.group(2))
+    return fields
+
+
+def parse_rpsl_fields(block: bytes) -> dict:
+    # Like parse_fields, but follows the RPSL rules irrd applied: a value
+    # continues on lines starting with whitespace or '+' and anything after
+    # a '#' is a comment
+    fields = {}
+    for m in _RPSL_FIELD_RE.finditer(block):
+        lines = m.group(2).split(b'\n')
+        # drop the '+' that marks an otherwise empty continuation line
+        lines[1:] = [line[1:] if line.startswith(b'+') else line for line in lines[1:]]
+        value = b' '.join(line.split(b'#', 1)[0].strip() for line in lines).strip()
+        if value:
+            fields.setdefault(m.group(1), []).append(value)
+    return fields
+
+
+def parse_property(fields: dict, name: bytes) -> str:
+    match = fields.get(name)
     if match:
         # remove empty lines and remove multiple names
-        x = ' '.join(list(filter(None, (x.strip().replace(
-            "%s: " % name, '').replace("%s: " % name, '') for x in match))))
-        # remove multiple whitespaces by using a split hack
-        # decode to latin-1 so it can be inserted in the database
-        return ' '.join(x.split())
+        x = b' '.join(list(filter(None, (x.strip().replace(
+            b"%s: " % name, b'').replace(b"%s: " % name, b'') for x in match))))
+        # remove multiple whitespaces by using a split hack, the value is
+        # only decoded here so the rest of the block never has to be
+        return b' '.join(x.split()).decode('utf-8', 'ignore')
     else:
         return None
 
 
-def parse_arin_inetnum(block: str) -> str:
-    # ARIN WHOIS IPv4
-    match = re.findall(r'^NetRange:[\s]*((?:\d{1,3}\.){3}\d{1,3})[\s]*-[\s]*((?:\d{1,3}\.){3}\d{1,3})', block, re.MULTILINE)
-    if match:
-        # netaddr can only handle strings, not bytes
-        ip_start = match[0][0]
-        ip_end = match[0][1]
-        cidrs = iprange_to_cidrs(ip_start, ip_end)
-        return cidrs
-    # ARIN WHOIS IPv6
-    match = re.findall(r'^NetRange:[\s]*([0-9a-fA-F:\/]{1,43})[\s]*-[\s]*([0-9a-fA-F:\/]{1,43})', block, re.MULTILINE)
+def intern_value(value: str) -> str:
+    return sys.intern(value) if value else value
+
+
+def parse_arin_inetnum(block: bytes) -> list:
+    # ARIN WHOIS IPv4, or else IPv6
+    match = _NETRANGE_V4_RE.search(block) or _NETRANGE_V6_RE.search(block)
     if match:
         # netaddr can only handle strings, not bytes
-        ip_start = match[0][0]
-        ip_end = match[0][1]
-        cidrs = iprange_to_cidrs(ip_start, ip_end)
-        return cidrs
+        ip_start = match.group(1).decode('ascii')
+        ip_end = match.group(2).decode('ascii')
+        # a single bad NetRange must not abort the whole run, skip the block
+        try:
+            cidrs = iprange_cached(ip_start, ip_end)
+        except (AddrFormatError, ValueError):
+            cidrs = ()
+        if not cidrs:
+            logger.warning(f"Could not convert ARIN range {ip_start} - {ip_end}")
+        return list(cidrs)
     logger.warning(f"Could not parse ARIN block {block}")
-    return None
+    return []
+
+
+def open_dump(filename: str):
+    if not filename.endswith('.gz'):
+        return open(filename, 'rb', buffering=READ_SIZE)
+    # Inflating the large RIPE/APNIC dumps dominates the read time, so prefer
+    # a parallel (rapidgzip) or ISA-L (isal) decompressor when installed
+    if rapidgzip is not None:
+        return rapidgzip.open(filename, parallelization=DECODE_THREADS)
+    if igzip is not None:
+        return igzip.open(filename, 'rb')
+    return gzip.open(filename, 'rb')
+
+
+def read_chunks(filename: str):
+    # Read the dump in big chunks and cut them right after the last blank
+    # line, so every chunk holds complete blocks only
+    buf = b''
+    with open_dump(filename) as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            buf += data
+
+            end = max(buf.rfind(b'\n\n'), buf.rfind(b'\n\r\n'))
+            if end != -1:
+                end = buf.index(b'\n', end + 1) + 1
+                yield buf[:end]
+                buf = buf[end:]
+
+    if buf:
+        yield buf
+
+
+def split_blocks(data: bytes) -> list:
+    # Let the regex engine find the blank lines and comments instead of
+    # walking the data line by line. The last piece is not followed by a
+    # blank line, so it is either empty or an unterminated block.
+    pieces = _BLANK_LINES_RE.split(data)
+    pieces.pop()
 
+    blocks = []
+    for single_block in pieces:
+        single_block = _COMMENT_RE.sub(b'', single_block)
+        if single_block.startswith(_RPSL_PREFIXES) or single_block.startswith(_ARIN_PREFIXES):
+            blocks.append(single_block)
+    return blocks
 
-def read_blocks(filename: str) -> list:
-    if filename.endswith('.gz'):
-        opemethod = gzip.open
-    else:
-        opemethod = open
 
-    cust_source = get_source(filename.split('/')[-1])
-    single_block = b''
-    blocks = []
+# The compiled tokenizer from _whois_parse.pyx is used when it has been built
+if read_blocks_c is not None:
+    split_blocks = read_blocks_c
 
-    # APNIC/LACNIC/RIPE/AFRINIC/IRR are all in RPSL
-    def is_rpsl_block_start(line):
-        if line.startswith(b'inetnum:'):
-            return True
-        elif line.startswith(b'inet6num:'):
-            return True
-        elif line.startswith(b'route:'):
-            return True
-        elif line.startswith(b'route6:'):
-            return True
-        elif line.startswith(b'route-set:'):
-            return True
-        return False
-
-    # ARIN's WHOIS database is in a custom format
-    def is_arin_block_start(line):
-        if line.startswith(b'NetHandle:'):
-            return True
-        elif line.startswith(b'V6NetHandle:'):
-            return True
-        elif line.startswith(b'OrgID:'):
-            return True
-        return False
-
-    with opemethod(filename, mode='rb') as f:
-        for line in f:
-            # skip comments
-            if line.startswith(b'%') or line.startswith(b'#'):
-                continue
-            # block end
-            if line.strip() == b'':
-                if is_rpsl_block_start(single_block) or is_arin_block_start(single_block):
-                    # add source
-                    single_block += b"cust_source: %s" % (cust_source)
-                    blocks.append(single_block)
-                    if len(blocks) % 1000 == 0:
-                        logger.debug(f"parsed another 1000 blocks ({len(blocks)} so far)")
-                    single_block = b''
-                else:
-                    single_block = b''
-            else:
-                single_block += line
-    
-    logger.info(f"Got {len(blocks)} blocks")
-    global NUM_BLOCKS
-    NUM_BLOCKS = len(blocks)
-    return blocks
+
+def read_blocks(filename: str):
+    # blocks are handed out one at a time instead of keeping the whole dump
+    # in memory as a list
+    for data in read_chunks(filename):
+        yield from split_blocks(data)
+
+
+def range_to_cidrs_v4(ip_start: str, ip_end: str) -> list:
+    # Same result as netaddr.iprange_to_cidrs for IPv4 but on plain ints:
+    # take the largest block that is aligned on lo and still fits the range
+    # octets are decimal even when zero padded (inet_aton would read them
+    # as octal), an octet above 255 raises ValueError
+    lo = int.from_bytes(bytes(int(octet) for octet in ip_start.split('.')), 'big')
+    hi = int.from_bytes(bytes(int(octet) for octet in ip_end.split('.')), 'big')
+    # an inverted range has no CIDRs, like in netaddr
+    cidrs = []
+    while lo <= hi:
+        alignment = (lo & -lo).bit_length() - 1 if lo else 32
+        size = min(alignment, (hi - lo + 1).bit_length() - 1)
+        address = '.'.join(str(octet) for octet in lo.to_bytes(4, 'big'))
+        cidrs.append(f"{address}/{32 - size}")
+        lo += 1 << size
+    return cidrs
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def iprange_cached(ip_start: str, ip_end: str) -> tuple:
+    # The same ranges show up over and over again (reassignments, route-set
+    # members), so remember the CIDRs of recently converted ones
+    if ':' in ip_start:
+        return tuple(str(cidr) for cidr in iprange_to_cidrs(ip_start, ip_end))
+    return tuple(range_to_cidrs_v4(ip_start, ip_end))
 
 
 def range_to_cidr(inetnum):
-    match = re.findall(r'((?:\d{1,3}\.){3}\d{1,3})[\s]*-[\s]*((?:\d{1,3}\.){3}\d{1,3})', inetnum, re.MULTILINE)
+    match = _IP_RANGE_V4_RE.search(inetnum)
     if match:
-        # netaddr can only handle strings, not bytes
-        ip_start = match[0][0]
-        ip_end = match[0][1]
-        return iprange_to_cidrs(ip_start, ip_end)[0]
+        ip_start = match.group(1)
+        ip_end = match.group(2)
+        # the RPSL blocks are not validated, so keep malformed ranges as is
+        try:
+            cidrs = iprange_cached(ip_start, ip_end)
+        except ValueError:
+            cidrs = ()
+        if not cidrs:
+            logger.warning(f"Could not convert range {inetnum}")
+            return inetnum
+        return cidrs[0]
+    elif _LACNIC_CIDR_RE.match(inetnum):
+        return normalize_lacnic_cidr(inetnum)
     else:
         return inetnum
 
 
-def parse_blocks(blocks, csv_writer):
-    def is_arin_customer(block):
-        return block.startswith('OrgID:')
+def normalize_lacnic_cidr(inetnum: str) -> str:
+    # LACNIC abbreviates its networks, e.g. 200.7/16 instead of 200.7.0.0/16
+    address, prefix = inetnum.split('/')
+    address += '.0' * (3 - address.count('.'))
+    try:
+        return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+    except ValueError:
+        return inetnum
+
+
+def is_arin_customer(block: bytes) -> bool:
+    return block.startswith(b'OrgID:')
+
+
+def is_arin_network(block: bytes) -> bool:
+    return block.startswith((b'NetHandle:', b'V6NetHandle:'))
 
-    def is_arin_network(block):
-        return block.startswith('NetHandle:') or block.startswith('V6NetHandle:')
 
+def parse_arin_org(block: bytes):
+    fields = parse_fields(block)
+    orgid = parse_property(fields, b'OrgID')
+    orgname = parse_property(fields, b'OrgName')
+    country = parse_property(fields, b'Country')
+    ARIN_ORGS[orgid] = (orgname, country)
+
+
+def parse_arin_orgs(blocks):
     for block in blocks:
-        # The RPSL parser works on str not bytes
-        b = block.decode('utf-8', 'ignore') 
-
-        inetnum = ''
-        netname = ''
-        description = ''
-        country = ''
-        maintained_by = ''
-        created = ''
-        last_modified = ''
-        source = ''
-
-        # ARIN has an Organization object which you have to parse out in order
-        # to get any details about network blocks
-        if is_arin_customer(b):
-            orgid = parse_property(b, 'OrgID')
-            orgname = parse_property(b, 'OrgName')
-            country = parse_property(b, 'Country')
-            ARIN_ORGS[orgid] = (orgname, country)
-            continue
-
-        # ARIN's dump format is also not in RPSL for whatever reason. They
-        # decided to make their own custom format.
-        elif is_arin_network(b):
-            inetnum = parse_arin_inetnum(b)
-            orgid = parse_property(b, 'OrgID')
-            netname = parse_property(b, 'NetName')
-            description = parse_property(b, 'NetHandle')
-            # ARIN IPv6
-            if not description:
-                description = parse_property(b, 'V6NetHandle')
-            country = ARIN_ORGS[orgid][1]
-            maintained_by = ARIN_ORGS[orgid][0]
-            created = parse_property(b, 'RegDate')
-            last_modified = parse_property(b, 'Updated')
-            source = parse_property(b, 'cust_source')
-
-        # All other data dumps are in RPSL so we can use a proper parser
-        # provided by the irrd package
-        else:
-            try:
-                rpsl_object = rpsl_object_from_text(b)
-
-                if 'inetnum' in rpsl_object.parsed_data:
-                    inetnum = rpsl_object.parsed_data['inetnum']
-                elif 'inet6num' in rpsl_object.parsed_data:
-                    inetnum = rpsl_object.parsed_data['inet6num']
-                elif 'route' in rpsl_object.parsed_data:
-                    inetnum = rpsl_object.parsed_data['route']
-                elif 'route6' in rpsl_object.parsed_data:
-                    inetnum = rpsl_object.parsed_data['route6']
-                elif 'route-set' in rpsl_object.parsed_data:
-                    netname = rpsl_object.parsed_data['route-set']
-                    # Changes type from str -> list
-                    if 'members' in rpsl_object.parsed_data:
-                        inetnum = rpsl_object.parsed_data['members']
-
-                # Some of these might exist, or not, depends entirely on RIR/IRR
-                if 'netname' in rpsl_object.parsed_data:
-                    netname = rpsl_object.parsed_data['netname']
-                if 'descr' in rpsl_object.parsed_data:
-                    description = ' '.join(rpsl_object.parsed_data['descr'])
-                if 'country' in rpsl_object.parsed_data:
-                    country = ' '.join(rpsl_object.parsed_data['country'])
-                if 'mnt-by' in rpsl_object.parsed_data:
-                    maintained_by = ' '.join(rpsl_object.parsed_data['mnt-by'])
-                if 'last-modified' in rpsl_object.parsed_data:
-                    last_modified = ' '.join(rpsl_object.parsed_data['last-modified'])
-                if 'changed' in rpsl_object.parsed_data:
-                    last_modified = ' '.join(rpsl_object.parsed_data['changed'])
-                if 'created' in rpsl_object.parsed_data:
-                    created = ' '.join(rpsl_object.parsed_data['created'])
-                
-                # Source is special, we should always have a source value 
-                if 'source' in rpsl_object.parsed_data:
-                    source = rpsl_object.parsed_data['source']
-                else:
-                    source = parse_property(b, 'cust_source')
-            except Exception as ex:
-                logger.error(ex)
-
-        if isinstance(inetnum, list):
-            for cidr in inetnum:
-                c = range_to_cidr(str(cidr))
-                row = [c, netname, description, country, maintained_by, created, last_modified, source]
-                csv_writer.writerow(row)
+        if is_arin_customer(block):
+            parse_arin_org(block)
+
+
+def init_worker(arin_orgs: dict):
+    global ARIN_ORGS
+    ARIN_ORGS = arin_orgs
+
+
+def process_block(block: bytes, cust_source: str) -> list:
+    inetnum = ''
+    netname = ''
+    description = ''
+    country = ''
+    maintained_by = ''
+    created = ''
+    last_modified = ''
+    source = ''
+
+    # ARIN has an Organization object which you have to parse out in order
+    # to get any details about network blocks. Those are collected up front
+    # by parse_arin_orgs so there is nothing left to do here.
+    if is_arin_customer(block):
+        return []
+
+    # ARIN's dump format is also not in RPSL for whatever reason. They
+    # decided to make their own custom format.
+    elif is_arin_network(block):
+        fields = parse_fields(block)
+        inetnum = parse_arin_inetnum(block)
+        orgid = parse_property(fields, b'OrgID')
+        netname = parse_property(fields, b'NetName')
+        description = parse_property(fields, b'NetHandle')
+        # ARIN IPv6
+        if not description:
+            description = parse_property(fields, b'V6NetHandle')
+        country = ARIN_ORGS[orgid][1]
+        maintained_by = ARIN_ORGS[orgid][0]
+        created = parse_property(fields, b'RegDate')
+        last_modified = parse_property(fields, b'Updated')
+        source = cust_source
+
+    # All other data dumps are in RPSL. Only a handful of attributes are
+    # needed, so they are read straight from the block instead of building
+    # a fully validated RPSL object
+    else:
+        fields = parse_rpsl_fields(block)
+
+        if b'inetnum' in fields:
+            inetnum = parse_property(fields, b'inetnum')
+        elif b'inet6num' in fields:
+            inetnum = parse_property(fields, b'inet6num')
+        elif b'route' in fields:
+            inetnum = parse_property(fields, b'route')
+        elif b'route6' in fields:
+            inetnum = parse_property(fields, b'route6')
+        elif b'route-set' in fields:
+            netname = parse_property(fields, b'route-set')
+            # Changes type from str -> list
+            if b'members' in fields:
+                members = (m.strip() for line in fields[b'members'] for m in line.split(b','))
+                inetnum = [m.decode('utf-8', 'ignore') for m in members if m]
+
+        # Some of these might exist, or not, depends entirely on RIR/IRR
+        if b'netname' in fields:
+            netname = parse_property(fields, b'netname')
+        if b'descr' in fields:
+            description = parse_property(fields, b'descr')
+        if b'country' in fields:
+            country = parse_property(fields, b'country')
+        if b'mnt-by' in fields:
+            maintained_by = parse_property(fields, b'mnt-by')
+        if b'last-modified' in fields:
+            last_modified = parse_property(fields, b'last-modified')
+        if b'changed' in fields:
+            last_modified = parse_property(fields, b'changed')
+        if b'created' in fields:
+            created = parse_property(fields, b'created')
+
+        # Source is special, we should always have a source value
+        if b'source' in fields:
+            source = parse_property(fields, b'source')
         else:
-            row = [range_to_cidr(inetnum), netname, description, country, maintained_by, created, last_modified, source]
-            csv_writer.writerow(row)
+            source = cust_source
+
+    # country and source only take a small set of distinct values; with one
+    # str object per value pickle sends each value once per result chunk and
+    # the parent unpickles one shared copy instead of one per row
+    country = intern_value(country)
+    source = intern_value(source)
+
+    rows = []
+    if isinstance(inetnum, list):
+        for cidr in inetnum:
+            c = range_to_cidr(str(cidr))
+            rows.append([c, netname, description, country, maintained_by, created, last_modified, source])
+    else:
+        rows.append([range_to_cidr(inetnum), netname, description, country, maintained_by, created, last_modified, source])
+    return rows
+
+
+def process_blocks(task: tuple) -> list:
+    global CURRENT_FILENAME
+    entry, blocks = task
+    CURRENT_FILENAME = entry
+    cust_source = get_source(entry)
+    rows = []
+    for block in blocks:
+        rows.extend(process_block(block, cust_source))
+    return rows
+
+
+def queue_blocks(entries: list, tasks: queue.Queue, errors: list):
+    # Runs in a reader thread and reads the dumps one after another, so the
+    # next file is already being decompressed while the workers still parse
+    # the previous one. The bounded queue keeps it from running too far ahead.
+    try:
+        for entry in entries:
+            LOG_CONTEXT.filename = entry
+            f_name = f"./databases/{entry}"
+            logger.info(f"parsing database file: {f_name}")
+            start_time = time.time()
+            num_blocks = 0
+            batch = []
+            for block in read_blocks(f_name):
+                batch.append(block)
+                if len(batch) >= TASK_BATCH_SIZE:
+                    tasks.put((entry, batch))
+                    num_blocks += len(batch)
+                    batch = []
+            if batch:
+                tasks.put((entry, batch))
+                num_blocks += len(batch)
+            logger.info(f"Got {num_blocks} blocks")
+            logger.info(f"database parsing finished: {round(time.time() - start_time, 2)} seconds")
+    except Exception as ex:
+        errors.append(ex)
+    finally:
+        tasks.put(None)
+
+
+def parse_blocks(entries: list, csv_writer):
+    tasks = queue.Queue(maxsize=TASK_QUEUE_SIZE)
+    # the reader thread leaves its exception here for the main thread
+    errors = []
+    # a daemon thread cannot hang the exit if the workers fail while it
+    # waits for room in the queue
+    reader = threading.Thread(target=queue_blocks, args=(entries, tasks, errors), daemon=True)
+
+    # fork keeps ARIN_ORGS copy-on-write instead of pickling it per worker.
+    # Windows has no fork, there the workers get ARIN_ORGS through initargs.
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    with context.Pool(NUM_WORKERS, initializer=init_worker, initargs=(ARIN_ORGS,)) as pool:
+        # only start reading once the workers are running
+        reader.start()
+        batch = []
+        for rows in pool.imap_unordered(process_blocks, iter(tasks.get, None)):
+            batch.extend(rows)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                csv_writer.writerows(batch)
+                batch.clear()
+        csv_writer.writerows(batch)
+        # re-raise anything that went wrong while reading the dumps
+        if errors:
+            raise errors[0]
 
 
 def main(output_file):
+    global CURRENT_FILENAME
     overall_start_time = time.time()
 
-    with open(output_file, 'w') as output_file_handle:
-        csv_writer = csv.writer(output_file_handle, delimiter='\t', quoting=csv.QUOTE_MINIMAL)
-        for entry in FILELIST:
-            global CURRENT_FILENAME
-            CURRENT_FILENAME = entry
-            f_name = f"./databases/{entry}"
+    entries = []
+    for entry in FILELIST:
+        CURRENT_FILENAME = entry
+        f_name = f"./databases/{entry}"
+        if os.path.exists(f_name):
+            entries.append(entry)
+        else:
+            logger.info(f"File {f_name} not found. Please download using download_dumps.sh")
+    CURRENT_FILENAME = "empty"
+    # the largest dumps take the longest, so start them first
+    entries.sort(key=lambda entry: os.path.getsize(f"./databases/{entry}"), reverse=True)
 
-            if os.path.exists(f_name):
-                logger.info(f"parsing database file: {f_name}")
-                start_time = time.time()
-                blocks = read_blocks(f_name)
-                logger.info(f"database parsing finished: {round(time.time() - start_time, 2)} seconds")
-                logger.info('parsing blocks')
-                start_time = time.time()
-                parse_blocks(blocks, csv_writer)
-                logger.info(f"block parsing finished: {round(time.time() - start_time, 2)} seconds")
-            else:
-                logger.info(f"File {f_name} not found. Please download using download_dumps.sh")
-
-            # Free the memory associated with the large dictionary
-            # since it is exclusive to ARIN's WHOIS database dump.
-            if entry == 'arin_db.txt':
-                global ARIN_ORGS
-                ARIN_ORGS = {}
+    # ARIN networks reference their organization by OrgID, so the
+    # organizations are collected in a first pass before any worker starts
+    if 'arin_db.txt' in entries:
+        CURRENT_FILENAME = 'arin_db.txt'
+        parse_arin_orgs(read_blocks('./databases/arin_db.txt'))
+        logger.info(f"Got {len(ARIN_ORGS)} ARIN organizations")
+
+    with open(output_file, 'w', buffering=WRITE_BUFFER_SIZE, newline='') as output_file_handle:
+        csv_writer = csv.writer(output_file_handle, delimiter='\t', quoting=csv.QUOTE_MINIMAL)
+        parse_blocks(entries, csv_writer)
 
     CURRENT_FILENAME = "empty"
     logger.info(f"script finished: {round(time.time() - overall_start_time, 2)} seconds")